@@ -1,16 +1,48 @@
 #!/usr/bin/env python3
 """
 Fetch Discourse API examples and save them to files.
+
+All URLs are fetched concurrently over a single HTTP/2 httpx client. ETag and
+Last-Modified values are kept in `<filename>.etag` / `<filename>.last-modified`
+sidecars so repeat runs only re-download endpoints that changed, and a BLAKE2b
+hash of each body (and the save mode) in `<filename>.blake2` lets unchanged
+bodies skip parsing and writing even without server validators; validators are
+only sent when the file was saved in the mode being requested. Bodies are
+saved as served unless --pretty is given.
+Fetches run in one anyio task group with a global deadline (BATCH_TIMEOUT),
+and an unreachable host cancels the remaining fetches instead of letting each
+one time out separately.
+Requires: httpx[http2,brotli,zstd], orjson (anyio comes with httpx; trio is
+optional for --backend trio)
 """
 
-import requests
-import json
-import os
+import argparse
+import anyio
+import hashlib
+import httpx
+import orjson
 from pathlib import Path
 
 # Base URL
 BASE_URL = "https://discuss.criticalfallibilism.com"
 
+# Maximum number of requests in flight at once (avoids HTTP 429s)
+MAX_CONCURRENCY = 8
+
+# Deadline for the whole batch; anything still running is cancelled
+BATCH_TIMEOUT = 60
+
+# Failures meaning the host can't be reached at all (refused, DNS, or
+# blackholed); any of these cancels the rest of the batch
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+# Read size used when streaming response bodies to disk
+CHUNK_SIZE = 64 * 1024
+
+# Write buffer for streamed files; large enough that a typical body is
+# flushed with a single write(2) instead of one per 8 KiB default buffer
+WRITE_BUFFER_SIZE = 1024 * 1024
+
 # URL to filename mappings
 URLS = [
     ("posts.rss", "posts.rss"),
@@ -29,59 +61,208 @@ URLS = [
     ("t/2108/posts.json?post_number=81", "t_2108_posts_pn_81.json"),
 ]
 
-def fetch_and_save(endpoint, filename):
-    """Fetch content from URL and save to file."""
+def sidecar_path(filepath, suffix):
+    """Return the path of a metadata sidecar file stored next to `filepath`."""
+    return filepath.with_suffix(filepath.suffix + suffix)
+
+def conditional_headers(filepath, mode):
+    """Build If-None-Match / If-Modified-Since headers from a previous run.
+
+    No validators are sent when the file was last saved in a different
+    `mode`, since a 304 would then leave it in the wrong format.
+    """
+    headers = {}
+    if not filepath.exists() or previous_save(filepath)[0] != mode:
+        return headers
+
+    etag_path = sidecar_path(filepath, '.etag')
+    last_modified_path = sidecar_path(filepath, '.last-modified')
+    if etag_path.exists():
+        headers['If-None-Match'] = etag_path.read_text().strip()
+    elif last_modified_path.exists():
+        headers['If-Modified-Since'] = last_modified_path.read_text().strip()
+    return headers
+
+def save_validators(filepath, response_headers):
+    """Persist ETag / Last-Modified so the next run can send a conditional GET."""
+    for header, suffix in (('ETag', '.etag'), ('Last-Modified', '.last-modified')):
+        path = sidecar_path(filepath, suffix)
+        value = response_headers.get(header)
+        if value:
+            path.write_text(value)
+        elif path.exists():
+            path.unlink()
+
+def save_mode(filename, pretty):
+    """Return how `filename` is written: 'pretty' (re-indented JSON) or 'raw'."""
+    return 'pretty' if pretty and filename.endswith('.json') else 'raw'
+
+def body_hasher(mode):
+    """Return a BLAKE2b hasher for response bodies.
+
+    The save mode is mixed in via `person` so switching --pretty on or off
+    never matches a file written in the other mode.
+    """
+    return hashlib.blake2b(digest_size=16, person=mode.encode())
+
+def previous_save(filepath):
+    """Return the (mode, body hash) recorded when `filepath` was last written.
+
+    Both are None when there is no usable record.
+    """
+    hash_path = sidecar_path(filepath, '.blake2')
+    if filepath.exists() and hash_path.exists():
+        mode, _, digest = hash_path.read_text().strip().partition(' ')
+        if digest:
+            return mode, digest
+    return None, None
+
+async def stream_to_file(response, part_path, hasher):
+    """Copy the response body to `part_path` in chunks; return bytes written.
+
+    Every chunk is also fed to `hasher`. The caller decides whether the
+    `.part` file replaces the real one, so an interrupted download never
+    clobbers a good copy; if the stream fails or is cancelled the `.part`
+    file is removed before the error propagates.
+    """
+    size = 0
+    try:
+        async with await anyio.open_file(part_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                hasher.update(chunk)
+                await f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    return size
+
+async def fetch_and_save(client, semaphore, endpoint, filename, pretty=False):
+    """Fetch content from URL and save to file.
+
+    Bodies are streamed to disk as-is; JSON is only parsed and re-indented
+    when `pretty` is set. Skips the download entirely when the server
+    answers 304 Not Modified, and skips parsing and writing when the body
+    hashes the same as last time.
+
+    Returns False for per-URL failures; re-raises CONNECT_ERRORS so the
+    caller can abandon the rest of the batch when the host is unreachable.
+    """
     url = f"{BASE_URL}/{endpoint}"
-    print(f"Fetching: {url}")
+
+    # Get the directory of this script
+    script_dir = Path(__file__).parent
+    filepath = script_dir / filename
+    part_path = sidecar_path(filepath, '.part')
+    mode = save_mode(filename, pretty)
+    old_hash = previous_save(filepath)[1]
+    hasher = body_hasher(mode)
 
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
+        async with semaphore:
+            async with client.stream('GET', url, headers=conditional_headers(filepath, mode)) as response:
+                if response.status_code == 304:
+                    print(f"  = {url} -> {filename} (unchanged)")
+                    return True
+                response.raise_for_status()
 
-        # Get the directory of this script
-        script_dir = Path(__file__).parent
-        filepath = script_dir / filename
+                if mode == 'pretty':
+                    body = await response.aread()
+                    hasher.update(body)
+                    size = len(body)
+                else:
+                    body = None
+                    size = await stream_to_file(response, part_path, hasher)
+                response_headers = response.headers
+                encoding = response_headers.get('Content-Encoding', 'identity')
 
-        # Pretty-print JSON files
-        if filename.endswith('.json'):
-            try:
-                json_data = response.json()
-                content = json.dumps(json_data, indent=2, ensure_ascii=False)
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(content)
-            except json.JSONDecodeError as e:
-                print(f"  ! Warning: Could not parse JSON, saving raw: {e}")
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
+        new_hash = hasher.hexdigest()
+        if new_hash == old_hash:
+            if body is None:
+                part_path.unlink()
+            save_validators(filepath, response_headers)
+            print(f"  = {url} -> {filename} (unchanged, {size} bytes)")
+            return True
+
+        if body is None:
+            part_path.replace(filepath)
         else:
-            # Save non-JSON files as-is (like RSS)
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
+            # Pretty-print JSON files
+            content = body
+            try:
+                json_data = orjson.loads(body)
+                content = orjson.dumps(json_data, option=orjson.OPT_INDENT_2)
+            except orjson.JSONDecodeError as e:
+                print(f"  ! Warning: Could not parse JSON for {filename}, saving raw: {e}")
+
+            # One write(2) for the whole document, off the event loop so
+            # other fetches keep progressing
+            await anyio.to_thread.run_sync(filepath.write_bytes, content)
 
-        print(f"  ✓ Saved to: {filename} ({len(response.content)} bytes)")
+        sidecar_path(filepath, '.blake2').write_text(f"{mode} {new_hash}")
+        save_validators(filepath, response_headers)
+
+        print(f"  ✓ {url} -> {filename} ({size} bytes, {encoding})")
         return True
 
-    except requests.exceptions.RequestException as e:
-        print(f"  ✗ Error fetching {url}: {e}")
+    except CONNECT_ERRORS as e:
+        print(f"  ✗ Could not connect for {url}: {e!r}")
+        raise
+    except httpx.HTTPError as e:
+        print(f"  ✗ Error fetching {url}: {e!r}")
         return False
 
-def main():
+async def main(pretty=False):
     """Main function to fetch all URLs."""
     print("Starting to fetch Discourse API examples...")
     print(f"Base URL: {BASE_URL}\n")
 
-    success_count = 0
-    fail_count = 0
+    semaphore = anyio.Semaphore(MAX_CONCURRENCY)
+    # One multiplexed HTTP/2 connection carries all requests. httpx builds
+    # Accept-Encoding from the decoders it can load, so installing the brotli
+    # and zstd extras is enough to negotiate br/zstd instead of gzip.
+    # Unlike requests/aiohttp, httpx only follows redirects when asked to.
+    limits = httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=4)
+    results = {}
 
-    for endpoint, filename in URLS:
-        if fetch_and_save(endpoint, filename):
-            success_count += 1
-        else:
-            fail_count += 1
-        print()
+    async with httpx.AsyncClient(http2=True, follow_redirects=True, timeout=30.0, limits=limits) as client:
+        with anyio.move_on_after(BATCH_TIMEOUT) as deadline:
+            async with anyio.create_task_group() as tg:
+
+                async def run(endpoint, filename):
+                    try:
+                        results[filename] = await fetch_and_save(client, semaphore, endpoint, filename, pretty)
+                    except CONNECT_ERRORS:
+                        # The host is unreachable; don't leave siblings waiting on it
+                        results[filename] = False
+                        tg.cancel_scope.cancel()
+
+                for endpoint, filename in URLS:
+                    tg.start_soon(run, endpoint, filename)
+
+    if deadline.cancelled_caught:
+        print(f"\n  ✗ Gave up after {BATCH_TIMEOUT}s")
+
+    success_count = sum(results.values())
+    fail_count = len(results) - success_count
+    cancelled_count = len(URLS) - len(results)
 
+    print()
     print("=" * 50)
-    print(f"Complete! Success: {success_count}, Failed: {fail_count}")
+    print(f"Complete! Success: {success_count}, Failed: {fail_count}, Cancelled: {cancelled_count}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fetch Discourse API examples into this directory.")
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Pretty-print JSON responses (default: save bodies exactly as served)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["asyncio", "trio"],
+        default="asyncio",
+        help="Async backend to run on (trio must be installed for 'trio')",
+    )
+    args = parser.parse_args()
+    anyio.run(main, args.pretty, backend=args.backend)
@@ -5,84 +5,235 @@ Tests:
 - Maximum comments retrievable
 - Optimal chunk size per request
 - Request rate limits
+Requires: aiohttp, aiolimiter, orjson, requests
 """
 
+import aiohttp
+import asyncio
+import orjson
+import re
 import requests
+from aiolimiter import AsyncLimiter
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader
+from urllib3.util.retry import Retry
 import sys
+from types import MappingProxyType
+from pathlib import Path
 import time
-from urllib.parse import urlparse
+from array import array
+from collections import deque
+
+
+# Headers sent with every TikTok request; Referer is formatted with the video ID
+TIKTOK_HEADERS = MappingProxyType({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Referer': 'https://www.tiktok.com/@i/video/{video_id}',
+})
+
+# Retry policy shared by the requests session and the aiohttp page fetcher
+RETRY = Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=[429, 500, 502, 503, 504],
+    raise_on_status=False,
+)
+
+# Numeric video ID in a full TikTok URL
+VIDEO_ID_RE = re.compile(r'/video/(\d+)')
+
+# Short link -> resolved video URL cache shared across runs
+SHORTLINK_CACHE_PATH = Path.home() / '.cache' / 'tiktok_shortlinks.json'
+
+# Shared keep-alive session so paginated requests reuse one TLS connection
+SESSION = requests.Session()
+SESSION.headers['User-Agent'] = TIKTOK_HEADERS['User-Agent']
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=RETRY))
+
+# Shared read-only fallback for missing nested objects
+_EMPTY = MappingProxyType({})
+
+# Number of comments shown from each end of the fetched list
+SAMPLE_SIZE = 5
+
+# Token bucket for comment API requests: at most 3 per second, bursts included
+# (AsyncLimiter is bound to one event loop, so run_with_session makes a new one)
+REQUESTS_PER_SECOND = 3
+
+# Most rows preallocated up front; beyond this the columns grow page by page
+# so a huge target_count doesn't reserve memory for comments that never come
+MAX_PREALLOC = 10_000
+
+# Bounds of the int64 like/timestamp columns
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def resolve_short_url(url):
+    """
+    Resolve a vm.tiktok.com / vt.tiktok.com short link to the full video URL
+
+    Resolved links are cached in SHORTLINK_CACHE_PATH so repeat runs skip the
+    redirect round-trip entirely.
+    """
+    try:
+        cache = orjson.loads(SHORTLINK_CACHE_PATH.read_bytes())
+    except (OSError, ValueError):
+        cache = {}
+
+    if url in cache:
+        return cache[url]
+
+    # HEAD is enough to follow the redirects; the body is never needed
+    resolved = SESSION.head(url, allow_redirects=True, timeout=10).url
+
+    # Only cache links that actually led to a video page
+    if '/video/' in resolved:
+        cache[url] = resolved
+        try:
+            SHORTLINK_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            SHORTLINK_CACHE_PATH.write_bytes(orjson.dumps(cache, option=orjson.OPT_INDENT_2))
+        except OSError:
+            pass
+
+    return resolved
 
 
 def extract_video_id(url):
     """Extract video ID from TikTok URL"""
     if 'vm.tiktok.com' in url or 'vt.tiktok.com' in url:
-        response = requests.get(url, allow_redirects=True)
-        url = response.url
+        url = resolve_short_url(url)
 
-    if '/video/' in url:
-        return url.split('/video/')[1].split('?')[0].split('/')[0]
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
 
-    return None
 
+def retry_delay(retry_after, attempt):
+    """Seconds to wait before retry number `attempt`, honouring Retry-After"""
+    if retry_after:
+        try:
+            return RETRY.parse_retry_after(retry_after)
+        except InvalidHeader:
+            pass
+    return RETRY.backoff_factor * (2 ** attempt)
 
-def test_chunk_size(video_id, chunk_size):
-    """Test a specific chunk size to see if it works"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Referer': f'https://www.tiktok.com/@i/video/{video_id}'
-    }
 
+def as_int64(value):
+    """Coerce an API count/timestamp to an int64 column value (0 if unusable)"""
+    try:
+        value = int(value or 0)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+    return min(max(value, INT64_MIN), INT64_MAX)
+
+
+async def fetch_comment_page(session, limiter, url):
+    """
+    Fetch and decode a single comment page
+
+    Retries on RETRY.status_forcelist responses, waiting for Retry-After
+    when the server sends it and backing off exponentially otherwise. Each
+    retry is printed, since hitting those limits is what this script is
+    measuring.
+
+    Returns:
+        (HTTP status, decoded JSON or None, number of HTTP attempts made)
+    """
+    for attempt in range(RETRY.total + 1):
+        async with limiter:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return response.status, orjson.loads(await response.read()), attempt + 1
+                if response.status not in RETRY.status_forcelist or attempt == RETRY.total:
+                    return response.status, None, attempt + 1
+                delay = retry_delay(response.headers.get('Retry-After'), attempt)
+        print(f"↻ HTTP {response.status}, retrying in {delay:.1f}s (retry {attempt + 1}/{RETRY.total})")
+        await asyncio.sleep(delay)
+
+
+async def test_chunk_size(session, limiter, video_id, chunk_size):
+    """Test a specific chunk size to see if it works"""
     url = f'https://www.tiktok.com/api/comment/list/?aid=1988&aweme_id={video_id}&count={chunk_size}&cursor=0'
 
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code != 200:
-            return False, 0, f"HTTP {response.status_code}"
+        status, data, _ = await fetch_comment_page(session, limiter, url)
+        if status != 200:
+            return False, 0, f"HTTP {status}"
 
-        data = response.json()
         comments_received = len(data.get('comments', []))
         return True, comments_received, "OK"
     except Exception as e:
         return False, 0, str(e)
 
 
-def fetch_comments_with_limit(video_id, target_count=1000, chunk_size=50):
+async def test_chunk_sizes(session, limiter, video_id, chunk_sizes):
+    """Probe several chunk sizes concurrently, returning results in input order"""
+    return await asyncio.gather(*(test_chunk_size(session, limiter, video_id, size) for size in chunk_sizes))
+
+
+async def fetch_comments_with_limit(session, limiter, video_id, target_count=1000, chunk_size=50):
     """
     Fetch comments up to target_count
 
+    The request for the next cursor is started as soon as the current page
+    arrives, before that page is extracted, so extraction and printing
+    overlap with the next round-trip.
+
     Args:
+        session: aiohttp session carrying the TikTok headers
+        limiter: AsyncLimiter pacing the page requests
         video_id: TikTok video ID
         target_count: Target number of comments to fetch
         chunk_size: Number of comments per request
 
     Returns:
-        List of comments and metadata about the fetch
+        Comment columns (texts, authors, likes, timestamps), the first and
+        last SAMPLE_SIZE (text, author, likes) rows, and metadata about the
+        fetch
     """
-    comments = []
+    # Columns are preallocated (up to MAX_PREALLOC rows), grown when a page
+    # doesn't fit and trimmed at the end; like/timestamp counts live in packed
+    # int64 arrays
+    capacity = min(max(target_count, 0), MAX_PREALLOC)
+    texts = [None] * capacity
+    authors = [None] * capacity
+    likes = array('q', bytes(8 * capacity))
+    timestamps = array('q', bytes(8 * capacity))
+    count = 0
+    head = []
+    tail = deque(maxlen=SAMPLE_SIZE)
     cursor = 0
     request_count = 0
+    page_number = 0
     start_time = time.time()
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Referer': f'https://www.tiktok.com/@i/video/{video_id}'
-    }
+    # Only the cursor changes between pages
+    url_base = f'https://www.tiktok.com/api/comment/list/?aid=1988&aweme_id={video_id}&count={chunk_size}&cursor='
 
     print(f"Fetching up to {target_count} comments (chunk size: {chunk_size})...")
     print("-" * 60)
 
-    while len(comments) < target_count:
-        url = f'https://www.tiktok.com/api/comment/list/?aid=1988&aweme_id={video_id}&count={chunk_size}&cursor={cursor}'
-        request_count += 1
-
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-
-            if response.status_code != 200:
-                print(f"✗ Request #{request_count} failed: HTTP {response.status_code}")
+    pending = None
+    if target_count > 0:
+        pending = asyncio.create_task(fetch_comment_page(session, limiter, url_base + str(cursor)))
+    try:
+        while pending is not None:
+            page_number += 1
+            try:
+                status, data, attempts = await pending
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                request_count += 1
+                print(f"✗ Request error: {e!r}")
+                break
+            except (ValueError, KeyError) as e:
+                request_count += 1
+                print(f"✗ JSON parsing error: {e}")
                 break
+            pending = None
+            request_count += attempts
 
-            data = response.json()
+            if status != 200:
+                print(f"✗ Page #{page_number} failed: HTTP {status}")
+                break
 
             # Check for errors in response
             if data.get('status_code') != 0:
@@ -90,52 +241,99 @@ def fetch_comments_with_limit(video_id, target_count=1000, chunk_size=50):
                 break
 
             # Check if we got comments
-            if 'comments' not in data or not data['comments']:
+            comments_page = data.get('comments')
+            if not comments_page:
                 print(f"✓ No more comments (reached end at cursor={cursor})")
                 break
 
-            batch_size = len(data['comments'])
-
-            # Extract comment data
-            for comment in data['comments']:
-                comments.append({
-                    'text': comment.get('text', ''),
-                    'author': comment.get('user', {}).get('unique_id', 'unknown'),
-                    'likes': comment.get('digg_count', 0),
-                    'timestamp': comment.get('create_time', 0),
-                })
+            batch_size = len(comments_page)
+            has_more = data.get('has_more', False)
 
-            print(f"✓ Request #{request_count}: Retrieved {batch_size} comments (total: {len(comments)})")
+            # Start fetching the next batch before processing this one
+            if has_more and count + batch_size < target_count:
+                cursor = data.get('cursor', cursor + chunk_size)
+                pending = asyncio.create_task(fetch_comment_page(session, limiter, url_base + str(cursor)))
+                # create_task only schedules the coroutine; yield once so it
+                # gets through the limiter and sends the request before the
+                # (synchronous) extraction below runs
+                await asyncio.sleep(0)
+
+            # Extract comment data, stopping at target_count
+            batch = comments_page[:target_count - count]
+            grow = count + len(batch) - capacity
+            if grow > 0:
+                texts.extend([None] * grow)
+                authors.extend([None] * grow)
+                likes.frombytes(bytes(8 * grow))
+                timestamps.frombytes(bytes(8 * grow))
+                capacity += grow
+
+            batch_start = count
+            for comment in batch:
+                texts[count] = comment.get('text', '')
+                authors[count] = comment.get('user', _EMPTY).get('unique_id', 'unknown')
+                likes[count] = as_int64(comment.get('digg_count'))
+                timestamps[count] = as_int64(comment.get('create_time'))
+                count += 1
+
+            # Keep the first and latest SAMPLE_SIZE rows as we go
+            for i in range(batch_start, min(count, SAMPLE_SIZE)):
+                head.append((texts[i], authors[i], likes[i]))
+            for i in range(max(batch_start, count - SAMPLE_SIZE), count):
+                tail.append((texts[i], authors[i], likes[i]))
+
+            print(f"✓ Page #{page_number}: Retrieved {count - batch_start} comments (total: {count})")
 
             # Check if there are more comments
-            has_more = data.get('has_more', False)
             if not has_more:
                 print(f"✓ API reports no more comments available")
                 break
-
-            # Update cursor for next batch
-            cursor = data.get('cursor', cursor + chunk_size)
-
-            # Small delay to avoid rate limiting
-            time.sleep(0.5)
-
-        except requests.exceptions.RequestException as e:
-            print(f"✗ Request error: {e}")
-            break
-        except (ValueError, KeyError) as e:
-            print(f"✗ JSON parsing error: {e}")
-            break
+    finally:
+        if pending is not None:
+            pending.cancel()
 
     elapsed_time = time.time() - start_time
 
+    del texts[count:], authors[count:], likes[count:], timestamps[count:]
+
     return {
-        'comments': comments,
+        'comments': {
+            'texts': texts,
+            'authors': authors,
+            'likes': likes,
+            'timestamps': timestamps,
+        },
+        'comment_count': count,
+        'head': head,
+        'tail': list(tail),
         'request_count': request_count,
         'elapsed_time': elapsed_time,
-        'comments_per_second': len(comments) / elapsed_time if elapsed_time > 0 else 0,
+        'comments_per_second': count / elapsed_time if elapsed_time > 0 else 0,
     }
 
 
+async def run_with_session(func, video_id, *args, **kwargs):
+    """
+    Open an aiohttp session with the TikTok headers for video_id and run
+    func(session, limiter, video_id, ...)
+    """
+    headers = {**TIKTOK_HEADERS, 'Referer': TIKTOK_HEADERS['Referer'].format(video_id=video_id)}
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(headers=headers, timeout=timeout) as session:
+        limiter = AsyncLimiter(max_rate=REQUESTS_PER_SECOND, time_period=1)
+        return await func(session, limiter, video_id, *args, **kwargs)
+
+
+def print_sample(title, sample, first_number):
+    """Print (text, author, likes) rows numbered from first_number"""
+    print("\n" + "=" * 60)
+    print(title)
+    print("=" * 60)
+    for i, (text, author, likes) in enumerate(sample, first_number):
+        print(f"\n#{i} @{author} (❤️ {likes})")
+        print(f"  {text[:100]}{'...' if len(text) > 100 else ''}")
+
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python test_tiktok_limits.py <tiktok_url> [target_count]")
@@ -163,12 +361,11 @@ def main():
     # print("TEST 1: Testing different chunk sizes")
     # print("-" * 60)
     # chunk_sizes = [20, 50, 100, 200, 500, 1000]
+    # results = asyncio.run(run_with_session(test_chunk_sizes, video_id, chunk_sizes))
 
-    # for size in chunk_sizes:
-    #     success, received, msg = test_chunk_size(video_id, size)
+    # for size, (success, received, msg) in zip(chunk_sizes, results):
     #     status = "✓" if success else "✗"
     #     print(f"{status} Chunk size {size:4d}: received {received:4d} comments - {msg}")
-    #     time.sleep(0.5)  # Rate limit protection
 
     # print()
 
@@ -178,36 +375,31 @@ def main():
 
     # Use chunk size 50 as a reasonable default
     # todo: this should just get first and last chunk
-    result = fetch_comments_with_limit(video_id, target_count, chunk_size=50)
+    result = asyncio.run(run_with_session(fetch_comments_with_limit, video_id, target_count, chunk_size=50))
 
     print()
     print("=" * 60)
     print("RESULTS")
     print("=" * 60)
-    print(f"Comments retrieved: {len(result['comments'])}")
+    comment_count = result['comment_count']
+    print(f"Comments retrieved: {comment_count}")
     print(f"Requests made: {result['request_count']}")
     print(f"Time elapsed: {result['elapsed_time']:.2f}s")
     print(f"Rate: {result['comments_per_second']:.1f} comments/sec")
 
-    if len(result['comments']) >= target_count:
+    if comment_count >= target_count:
         print(f"\n✓ SUCCESS: Retrieved target of {target_count} comments")
-    elif len(result['comments']) > 0:
-        print(f"\n⚠ PARTIAL: Retrieved {len(result['comments'])}/{target_count} comments")
+    elif comment_count > 0:
+        print(f"\n⚠ PARTIAL: Retrieved {comment_count}/{target_count} comments")
         print(f"  (May have reached end of available comments)")
     else:
         print(f"\n✗ FAILED: No comments retrieved")
 
     # Show sample of comments
-    if result['comments']:
-        print("\n" + "=" * 60)
-        print("SAMPLE COMMENTS (first 5)")
-        print("=" * 60)
-        for i, comment in enumerate(result['comments'][:5], 1):
-            print(f"\n#{i} @{comment['author']} (❤️ {comment['likes']})")
-            print(f"  {comment['text'][:100]}{'...' if len(comment['text']) > 100 else ''}")
-        print("SAMPLE COMMENTS (last 5)")
-        print("=" * 60)
-        # todo
+    if comment_count:
+        print_sample(f"SAMPLE COMMENTS (first {SAMPLE_SIZE})", result['head'], 1)
+        tail = result['tail']
+        print_sample(f"SAMPLE COMMENTS (last {SAMPLE_SIZE})", tail, comment_count - len(tail) + 1)
 
 
 if __name__ == '__main__':
@@ -2,26 +2,89 @@
 """
 Test script for TikTok comment scraping
 Based on xtekky/TikTok-Comment-Scraper approach
+Requires: orjson, requests
 """
 
+import orjson
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import sys
-from urllib.parse import urlparse, parse_qs
+from types import MappingProxyType
+from pathlib import Path
+
+
+# Headers sent with every TikTok request; Referer is formatted with the video ID
+TIKTOK_HEADERS = MappingProxyType({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Referer': 'https://www.tiktok.com/@i/video/{video_id}',
+})
+
+# Numeric video ID in a full TikTok URL
+VIDEO_ID_RE = re.compile(r'/video/(\d+)')
+
+# Shared read-only fallback for missing nested objects
+_EMPTY = MappingProxyType({})
+
+# Short link -> resolved video URL cache shared across runs
+SHORTLINK_CACHE_PATH = Path.home() / '.cache' / 'tiktok_shortlinks.json'
+
+# Shared keep-alive session so paginated requests reuse one TLS connection
+SESSION = requests.Session()
+SESSION.headers['User-Agent'] = TIKTOK_HEADERS['User-Agent']
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False,
+    ),
+))
+
+
+def resolve_short_url(url):
+    """
+    Resolve a vm.tiktok.com / vt.tiktok.com short link to the full video URL
+
+    Resolved links are cached in SHORTLINK_CACHE_PATH so repeat runs skip the
+    redirect round-trip entirely.
+    """
+    try:
+        cache = orjson.loads(SHORTLINK_CACHE_PATH.read_bytes())
+    except (OSError, ValueError):
+        cache = {}
+
+    if url in cache:
+        return cache[url]
+
+    # HEAD is enough to follow the redirects; the body is never needed
+    resolved = SESSION.head(url, allow_redirects=True, timeout=10).url
+
+    # Only cache links that actually led to a video page
+    if '/video/' in resolved:
+        cache[url] = resolved
+        try:
+            SHORTLINK_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            SHORTLINK_CACHE_PATH.write_bytes(orjson.dumps(cache, option=orjson.OPT_INDENT_2))
+        except OSError:
+            pass
+
+    return resolved
 
 
 def extract_video_id(url):
     """Extract video ID from TikTok URL"""
     # Handle shortened URLs (vm.tiktok.com, vt.tiktok.com)
     if 'vm.tiktok.com' in url or 'vt.tiktok.com' in url:
-        response = requests.get(url, allow_redirects=True)
-        url = response.url
+        url = resolve_short_url(url)
 
     # Extract ID from full URL
     # Format: https://www.tiktok.com/@username/video/7123456789
-    if '/video/' in url:
-        return url.split('/video/')[1].split('?')[0].split('/')[0]
-
-    return None
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
 
 
 def fetch_comments(video_id, max_comments=100):
@@ -33,24 +96,26 @@ def fetch_comments(video_id, max_comments=100):
         max_comments: Maximum number of comments to fetch (for testing)
 
     Returns:
-        List of comment dictionaries with text, author, likes, etc.
+        Dict of parallel comment columns: texts, authors, likes, timestamps
     """
-    comments = []
+    texts = []
+    authors = []
+    likes = []
+    timestamps = []
     cursor = 0
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Referer': f'https://www.tiktok.com/@i/video/{video_id}'
-    }
-
     print(f"Fetching comments for video ID: {video_id}")
     print("-" * 60)
 
-    while len(comments) < max_comments:
-        url = f'https://www.tiktok.com/api/comment/list/?aid=1988&aweme_id={video_id}&count=50&cursor={cursor}'
+    # Only the cursor changes between pages
+    url_base = f'https://www.tiktok.com/api/comment/list/?aid=1988&aweme_id={video_id}&count=50&cursor='
+    headers = {'Referer': TIKTOK_HEADERS['Referer'].format(video_id=video_id)}
+
+    while len(texts) < max_comments:
+        url = url_base + str(cursor)
 
         try:
-            response = requests.get(url, headers=headers, timeout=10)
+            response = SESSION.get(url, headers=headers, timeout=10)
 
             # Check for successful response
             if response.status_code != 200:
@@ -58,24 +123,20 @@ def fetch_comments(video_id, max_comments=100):
                 print(f"Response: {response.text[:200]}")
                 break
 
-            data = response.json()
+            data = orjson.loads(response.content)
 
             # Check if we got comments
-            if 'comments' not in data or not data['comments']:
+            comments_page = data.get('comments')
+            if not comments_page:
                 print(f"No more comments found (cursor={cursor})")
                 break
 
-            # Extract comment data
-            for comment in data['comments']:
-                comments.append({
-                    'text': comment.get('text', ''),
-                    'author': comment.get('user', {}).get('unique_id', 'unknown'),
-                    'likes': comment.get('digg_count', 0),
-                    'timestamp': comment.get('create_time', 0),
-                })
-
-                if len(comments) >= max_comments:
-                    break
+            # Extract comment data, only from the part of the batch still needed
+            batch = comments_page[:max_comments - len(texts)]
+            texts.extend([comment.get('text', '') for comment in batch])
+            authors.extend([comment.get('user', _EMPTY).get('unique_id', 'unknown') for comment in batch])
+            likes.extend([comment.get('digg_count', 0) for comment in batch])
+            timestamps.extend([comment.get('create_time', 0) for comment in batch])
 
             # Check if there are more comments
             if not data.get('has_more', False):
@@ -93,7 +154,12 @@ def fetch_comments(video_id, max_comments=100):
             print(f"Response text: {response.text[:500]}")
             break
 
-    return comments
+    return {
+        'texts': texts,
+        'authors': authors,
+        'likes': likes,
+        'timestamps': timestamps,
+    }
 
 
 def main():
@@ -112,20 +178,21 @@ def main():
 
     # Fetch a small number of comments for testing
     comments = fetch_comments(video_id, max_comments=20)
+    comment_count = len(comments['texts'])
 
     print("\n" + "=" * 60)
-    print(f"Retrieved {len(comments)} comments:")
+    print(f"Retrieved {comment_count} comments:")
     print("=" * 60)
 
-    for i, comment in enumerate(comments, 1):
-        print(f"\n#{i} @{comment['author']} (❤️ {comment['likes']})")
-        print(f"  {comment['text']}")
+    for i, (text, author, likes) in enumerate(zip(comments['texts'], comments['authors'], comments['likes']), 1):
+        print(f"\n#{i} @{author} (❤️ {likes})")
+        print(f"  {text}")
 
-    if not comments:
+    if not comment_count:
         print("\n⚠️  No comments retrieved - the API may have changed or requires authentication")
         print("This is common with TikTok scrapers as they frequently update their API")
     else:
-        print(f"\n✓ Successfully retrieved {len(comments)} comments")
+        print(f"\n✓ Successfully retrieved {comment_count} comments")
 
 
 if __name__ == '__main__':